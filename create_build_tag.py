@@ -12,39 +12,41 @@ import os
 import sys
 import subprocess
 import datetime
-import hashlib
 
-def run_command(command):
-    """Run a shell command and return its output"""
-    print(f"Running: {command}")
+def run_command(argv):
+    """Run a command (argv list, no shell) and return its output"""
+    print(f"Running: {' '.join(argv)}")
     try:
         result = subprocess.run(
-            command, 
-            shell=True, 
-            check=True, 
-            stdout=subprocess.PIPE, 
+            argv,
+            check=True,
+            stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             text=True
         )
         return result.stdout.strip()
     except subprocess.CalledProcessError as e:
-        print(f"Error executing command: {command}")
+        print(f"Error executing command: {' '.join(argv)}")
         print(f"Error message: {e.stderr}")
         return None
+    except FileNotFoundError:
+        print(f"Command not found: {argv[0]}")
+        return None
 
 def git_is_repo():
     """Check if current directory is a git repository"""
-    return run_command("git rev-parse --is-inside-work-tree") == "true"
+    return run_command(["git", "rev-parse", "--is-inside-work-tree"]) == "true"
 
 def git_last_commit_hash():
     """Get the hash of the last commit"""
-    return run_command("git rev-parse HEAD")
+    return run_command(["git", "rev-parse", "HEAD"])
 
 def generate_build_hash():
-    """Generate a short hash based on timestamp for unique build identification"""
-    timestamp = datetime.datetime.now().isoformat()
-    hash_obj = hashlib.md5(timestamp.encode())
-    return hash_obj.hexdigest()[:8]  # Return first 8 chars of hash
+    """Generate a short random token for unique build identification"""
+    # 4 random bytes give the same 8 hex chars as the old MD5-of-timestamp
+    # approach without the hashing, and cannot collide for builds started
+    # in the same instant
+    return os.urandom(4).hex()
 
 def create_build_tag(env_name):
     """Create a build tag for the latest commit"""
@@ -65,7 +67,7 @@ def create_build_tag(env_name):
     
     # Create the tag
     tag_message = f"Build {build_id} for environment {env_name}"
-    result = run_command(f'git tag -a {build_id} -m "{tag_message}" {commit_hash}')
+    result = run_command(["git", "tag", "-a", build_id, "-m", tag_message, commit_hash])
     
     if result is not None:
         print(f"Successfully created build tag: {build_id}")
@@ -84,9 +86,12 @@ def main():
     
     if create_build_tag(env_name):
         print("Build tag created successfully.")
-        # Show list of recent tags
+        # Show list of recent tags; git sorts them and Python takes the top
+        # five, so no shell pipeline or head subprocess is needed
         print("\nRecent build tags:")
-        run_command('git tag -l "build_*" --sort=-creatordate | head -n 5')
+        tags = run_command(["git", "tag", "-l", "build_*", "--sort=-creatordate"])
+        if tags:
+            print("\n".join(tags.splitlines()[:5]))
         return 0
     else:
         print("Failed to create build tag.")
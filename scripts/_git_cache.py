@@ -0,0 +1,153 @@
+"""Shared git metadata cache for the build scripts.
+
+Each build-related script used to shell out to git on its own. This
+module collects the metadata once and persists it under
+.pio/build/git_meta.json keyed on the mtimes of .git/HEAD and
+.git/index, so any script (and any PlatformIO environment) that loads
+after the first one reuses the result without spawning git.
+"""
+
+import json
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+_CACHE_PATH = os.path.join(".pio", "build", "git_meta.json")
+
+# In-process memo so repeated lookups within one interpreter (e.g. several
+# scripts importing this module) don't even touch the disk cache. A plain
+# dict is used deliberately - it is the hot path and needs no lru_cache
+# wrapper overhead.
+_INFO_MEMO = {}
+
+def _noop_log(message):
+    pass
+
+def run_git(args, fallback="", log=_noop_log):
+    """Run a git command (argv list, no shell) and return its stripped stdout"""
+    log(f"Running command: git {' '.join(args)}")
+    try:
+        result = subprocess.run(
+            ["git"] + list(args),
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        output = result.stdout.strip()
+        log(f"Command output: {output}")
+        return output
+    except subprocess.CalledProcessError as e:
+        log(f"Command error: {e.stderr}")
+        return fallback
+    except FileNotFoundError:
+        log("git executable not found")
+        return fallback
+
+def cache_key():
+    """Build a cache key that changes whenever HEAD, the index or a tag moves
+
+    The cached payload includes the describe results, and creating a tag
+    touches neither .git/HEAD nor .git/index - it writes a loose ref
+    under .git/refs/tags (updating that directory's mtime) or rewrites
+    .git/packed-refs. Both are folded in so a rebuild right after
+    tagging (the release flow) sees the new tag instead of stale cache.
+    """
+    try:
+        key = str(os.stat(os.path.join(".git", "HEAD")).st_mtime_ns)
+    except OSError:
+        return None
+    for path in (os.path.join(".git", "index"),
+                 os.path.join(".git", "refs", "tags"),
+                 os.path.join(".git", "packed-refs")):
+        try:
+            key += ":" + str(os.stat(path).st_mtime_ns)
+        except OSError:
+            key += ":-"
+    return key
+
+def collect_git_info(log=_noop_log):
+    """Collect git metadata with a single batched git invocation
+
+    Returns a dict with keys: is_repo, hash, branch, tag, exact_tag.
+    Repo check, commit hash and branch name come from one rev-parse call
+    instead of three separate subprocesses; the tag lookups still need
+    their own describe calls as rev-parse cannot answer them.
+    """
+    info = {
+        "is_repo": False,
+        "hash": "unknown",
+        "branch": "unknown",
+        "tag": "no-tag",
+        "exact_tag": ""
+    }
+
+    # The rev-parse batch and the exact-tag describe are independent, so
+    # overlap their fork/exec in a small thread pool; both threads block
+    # in waitpid, so the GIL is not a factor
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        rev_parse_future = executor.submit(
+            run_git, ["rev-parse", "--is-inside-work-tree", "HEAD", "--abbrev-ref", "HEAD"], log=log)
+        exact_tag_future = executor.submit(
+            run_git, ["describe", "--exact-match", "--tags", "HEAD"], fallback="", log=log)
+        output = rev_parse_future.result()
+        exact_tag = exact_tag_future.result()
+
+    lines = output.splitlines()
+    if not lines or lines[0] != "true":
+        log("Not a git repository")
+        return info
+
+    info["is_repo"] = True
+    if len(lines) > 1:
+        info["hash"] = lines[1][:7]
+    if len(lines) > 2:
+        info["branch"] = lines[2]
+
+    info["exact_tag"] = exact_tag
+    if info["exact_tag"]:
+        # HEAD is tagged, so the nearest tag is that same tag - no need
+        # to spawn a second describe
+        info["tag"] = info["exact_tag"]
+    else:
+        info["tag"] = run_git(["describe", "--tags", "--abbrev=0"], fallback="no-tag", log=log)
+
+    log(f"Git info: {info}")
+    return info
+
+def collect_git_info_cached(log=_noop_log):
+    """Collect git info, reusing an on-disk cache across script invocations
+
+    PlatformIO re-executes the build scripts on every run (and once per
+    environment), so cache the git metadata in the build directory keyed
+    on .git/HEAD and .git/index mtimes. On a hit no git subprocess is
+    spawned at all.
+    """
+    key = cache_key()
+    memo_key = (os.getcwd(), key)
+
+    if key is not None:
+        if memo_key in _INFO_MEMO:
+            return _INFO_MEMO[memo_key]
+        try:
+            with open(_CACHE_PATH) as f:
+                cached = json.load(f)
+            if cached.get("key") == key:
+                log("Using cached git info")
+                _INFO_MEMO[memo_key] = cached["info"]
+                return cached["info"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    info = collect_git_info(log=log)
+
+    if key is not None and info["is_repo"]:
+        _INFO_MEMO[memo_key] = info
+        try:
+            os.makedirs(os.path.dirname(_CACHE_PATH), exist_ok=True)
+            with open(_CACHE_PATH, "w") as f:
+                json.dump({"key": key, "info": info}, f)
+        except OSError as e:
+            log(f"Failed to write git cache: {e}")
+
+    return info
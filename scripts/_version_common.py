@@ -0,0 +1,218 @@
+"""Shared version computation for the PlatformIO build scripts.
+
+SCons re-executes pre_build.py for every environment it configures, but
+an imported module is evaluated once per interpreter and then served
+from sys.modules. Keeping the git queries and the source-tree timestamp
+scan here (memoized in get_version_data) means the second and later
+environment loads get the version string back as a dict lookup instead
+of repeating the work.
+"""
+
+import datetime
+import glob
+import json
+import os
+import re
+import subprocess
+
+from _git_cache import collect_git_info_cached, run_git
+
+# Compiled once at module scope; release tags are 'v' followed by a number
+_RELEASE_RE = re.compile(r'^v\d+')
+
+# Memoized result of get_version_data for this interpreter
+_version_data = None
+
+def _noop_log(message):
+    pass
+
+def is_release_tag(tag):
+    """Check if tag is a release version (starts with v followed by number)"""
+    return bool(_RELEASE_RE.match(tag))
+
+def get_clean_tree_timestamp(log=_noop_log):
+    """Return the last commit time when the working tree is clean, else None
+
+    On a clean tree no tracked file is newer than HEAD, so the commit
+    time stands in for the newest source mtime and the whole filesystem
+    walk is replaced by one git call. New untracked files fall back to
+    the walk once they are added to the index.
+
+    The shortcut is disabled when a littlefs.bin newer than the commit
+    time exists: right after checking out an older commit the commit
+    time lies far in the past, and substituting it would make the
+    leftover image from the previous checkout pass the staleness check
+    in create_combined_firmware.py.
+    """
+    try:
+        result = subprocess.run(
+            ["git", "diff", "--quiet", "--ignore-submodules", "HEAD"],
+            check=False,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+    except FileNotFoundError:
+        return None
+    if result.returncode != 0:
+        return None
+
+    # %ct gives the epoch seconds directly; comparisons and rendering
+    # below then go through fromtimestamp, which yields local time - the
+    # ISO %cI form kept the committer's UTC offset and strftime silently
+    # dropped it, skewing the mtime comparisons by the offset difference
+    commit_time = run_git(["log", "-1", "--format=%ct"], fallback="", log=log)
+    try:
+        commit_epoch = int(commit_time)
+    except ValueError:
+        return None
+
+    for littlefs_bin in glob.glob(os.path.join(".pio", "build", "*", "littlefs.bin")):
+        try:
+            if os.path.getmtime(littlefs_bin) > commit_epoch:
+                log(f"{littlefs_bin} is newer than the last commit - using source mtimes instead")
+                return None
+        except OSError:
+            continue
+
+    return datetime.datetime.fromtimestamp(commit_epoch).strftime("%Y-%m-%d %H:%M:%S")
+
+def get_most_recent_source_timestamp(log=_noop_log):
+    """Find the most recently modified source file and use its timestamp
+
+    One walk per source root replaces the old per-pattern recursive
+    glob calls, which each re-traversed the same trees. DirEntry
+    carries the stat result from the directory read, so inspecting a
+    file costs no extra syscall on most platforms.
+    """
+    # Per-root suffix filters, matching the old glob patterns; None means
+    # every file counts (web/public ships assets of any type)
+    source_roots = {
+        "src": {".cpp", ".c", ".h"},
+        "include": {".h"},
+        "web/src": {".jsx", ".js", ".css"},
+        "web/public": None
+    }
+
+    # Files to explicitly exclude (generated by the pre-build step)
+    exclude_files = {
+        "include/version.h",
+        "data/web/version.json",
+        "web/public/version.json"
+    }
+
+    most_recent_time = 0
+    most_recent_file = None
+
+    for root, suffixes in source_roots.items():
+        for dirpath, dirnames, filenames in os.walk(root):
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    if suffixes is not None and os.path.splitext(entry.name)[1] not in suffixes:
+                        continue
+                    filepath = os.path.join(dirpath, entry.name).replace("\\", "/")
+                    if filepath in exclude_files:
+                        continue
+                    try:
+                        mtime = entry.stat(follow_symlinks=False).st_mtime
+                    except OSError:
+                        # File might have been deleted or is inaccessible
+                        continue
+                    if mtime > most_recent_time:
+                        most_recent_time = mtime
+                        most_recent_file = filepath
+
+    # Top-level project files checked individually
+    for filepath in ("platformio.ini", "package.json"):
+        try:
+            mtime = os.path.getmtime(filepath)
+        except OSError:
+            continue
+        if mtime > most_recent_time:
+            most_recent_time = mtime
+            most_recent_file = filepath
+
+    if most_recent_file:
+        # Convert timestamp to datetime
+        dt = datetime.datetime.fromtimestamp(most_recent_time)
+        timestamp_str = dt.strftime("%Y-%m-%d %H:%M:%S")
+        log(f"Most recent source file: {most_recent_file}")
+        log(f"Source file timestamp: {timestamp_str}")
+        return timestamp_str
+    else:
+        # Fallback to current time if no source files found
+        timestamp_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        log(f"No source files found, using current time: {timestamp_str}")
+        return timestamp_str
+
+def get_version_data(log=_noop_log):
+    """Compute (once per interpreter) the version fields for this build
+
+    Returns a dict with keys: timestamp, version_info, git_hash,
+    git_branch, exact_tag, is_release.
+    """
+    global _version_data
+    if _version_data is not None:
+        log("Reusing version data computed earlier in this session")
+        return _version_data
+
+    # A clean git tree lets the last commit time stand in for the
+    # filesystem walk
+    timestamp = get_clean_tree_timestamp(log=log)
+    if timestamp:
+        log(f"Clean git tree - using last commit time: {timestamp}")
+    else:
+        timestamp = get_most_recent_source_timestamp(log=log)
+    log(f"Using timestamp: {timestamp}")
+
+    # Default version information if not in a git repo
+    version_info = f"Build: {timestamp}"
+    exact_tag = ""
+    git_hash = "unknown"
+    git_branch = "unknown"
+    is_release = False
+
+    git_info = collect_git_info_cached(log=log)
+    if git_info["is_repo"]:
+        git_hash = git_info["hash"]
+        git_branch = git_info["branch"]
+        git_tag = git_info["tag"]
+        exact_tag = git_info["exact_tag"]
+        is_release = bool(exact_tag and is_release_tag(exact_tag))
+        log(f"Is release tag '{exact_tag}': {is_release}")
+
+        # If we're on a release tag, use simplified version string
+        if is_release:
+            version_info = f"{exact_tag} - Build: {timestamp}"
+        else:
+            # For development builds, include full git information
+            version_info = f"Git: {git_branch}@{git_hash} ({git_tag}) - Build: {timestamp}"
+
+    log(f"Generated version: {version_info}")
+
+    _version_data = {
+        "timestamp": timestamp,
+        "version_info": version_info,
+        "git_hash": git_hash,
+        "git_branch": git_branch,
+        "exact_tag": exact_tag,
+        "is_release": is_release
+    }
+    return _version_data
+
+def get_web_version_json(log=_noop_log):
+    """Serialized content of data/web/version.json for this build
+
+    Shared between pre_build.py (initial generation) and
+    create_combined_firmware.py (regeneration after the vite build wipes
+    data/web), so both always agree byte for byte.
+    """
+    data = get_version_data(log=log)
+    return json.dumps({
+        "filesystem_version": data["version_info"],
+        "build_time": data["timestamp"],  # Same timestamp as version.h
+        "description": "ESP32 ET112 Proxy Web Interface",
+        "git_hash": data["git_hash"],
+        "git_branch": data["git_branch"]
+    }, indent=2)
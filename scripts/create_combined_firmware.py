@@ -15,33 +15,59 @@ This ensures both firmware and web interface are updated together atomically.
 """
 
 import os
+import re
 import sys
 import subprocess
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Compiled once at import; a bytes pattern lets the version.h scan skip
+# decoding the file
+_TS_RE = re.compile(rb'#define BUILD_TIMESTAMP "([^"]+)"')
+
+# Import esptool once at module load so repeated post-actions in one SCons
+# session don't pay the import cost again; None selects the subprocess
+# fallback in merge_binaries
+try:
+    import esptool
+except ImportError:
+    esptool = None
+
+# Fixed head of the merge_bin argument list; the per-build output path and
+# offset/file pairs are appended in create_combined_firmware
+_ESPTOOL_BASE_ARGS = ["--chip", "esp32", "merge_bin", "-o"]
 
 # Import PlatformIO environment
 Import("env")
 
+# Shared version computation, also used by pre_build.py
+sys.path.insert(0, os.path.join(env.get("PROJECT_DIR", os.getcwd()), "scripts"))
+from _version_common import get_web_version_json
+
 def debug_log(message):
     """Log debug message to console"""
     print(f"COMBINED-BUILD: {message}")
 
-def run_command(command):
-    """Run a shell command and return its output"""
-    debug_log(f"Running: {command}")
+def run_command(argv, cwd=None):
+    """Run a command (argv list, no shell) and return its output"""
+    debug_log(f"Running: {' '.join(argv)}")
     try:
         result = subprocess.run(
-            command, 
-            shell=True, 
-            check=True, 
-            stdout=subprocess.PIPE, 
+            argv,
+            check=True,
+            stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True
+            text=True,
+            cwd=cwd
         )
         return result.stdout.strip()
     except subprocess.CalledProcessError as e:
         debug_log(f"Command failed: {e.stderr}")
         return None
+    except FileNotFoundError:
+        debug_log(f"Command not found: {argv[0]}")
+        return None
 
 def get_build_timestamp(project_dir):
     """Extract build timestamp from version.h"""
@@ -52,17 +78,19 @@ def get_build_timestamp(project_dir):
         return None
     
     try:
-        with open(version_h_path, 'r') as f:
-            content = f.read()
-            
+        # version.h is tiny; a bounded read of the first 4 KiB is plenty
+        with open(version_h_path, 'rb') as f:
+            content = f.read(4096)
+
         # Look for BUILD_TIMESTAMP define
-        import re
-        match = re.search(r'#define BUILD_TIMESTAMP "([^"]+)"', content)
+        match = _TS_RE.search(content)
         if match:
-            timestamp_str = match.group(1)
-            # Parse timestamp: "2025-09-04 08:32:58"
+            timestamp_str = match.group(1).decode('ascii')
+            # Parse timestamp: "2025-09-04 08:32:58". fromisoformat avoids
+            # strptime's per-call format-string interpretation; the T swap
+            # keeps it working on Python < 3.11
             from datetime import datetime
-            timestamp = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
+            timestamp = datetime.fromisoformat(timestamp_str.replace(' ', 'T'))
             debug_log(f"Build timestamp from version.h: {timestamp_str}")
             return timestamp
         else:
@@ -73,6 +101,208 @@ def get_build_timestamp(project_dir):
         debug_log(f"Error reading build timestamp: {e}")
         return None
 
+def compute_web_source_hash(web_dir):
+    """Hash web source metadata (relpath, mtime, size) to detect changes cheaply
+
+    Hashing stat results instead of file contents keeps this to one
+    directory walk with no file reads.
+    """
+    import hashlib
+    h = hashlib.blake2b(digest_size=16)
+
+    paths = [
+        os.path.join(web_dir, "index.html"),
+        os.path.join(web_dir, "package.json"),
+        os.path.join(web_dir, "package-lock.json"),
+        os.path.join(web_dir, "vite.config.js")
+    ]
+    for root in (os.path.join(web_dir, "src"), os.path.join(web_dir, "public")):
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in sorted(filenames):
+                # version.json is regenerated every build by pre_build.py
+                if name == "version.json":
+                    continue
+                paths.append(os.path.join(dirpath, name))
+
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        rel = os.path.relpath(path, web_dir).replace("\\", "/")
+        h.update(f"{rel}:{st.st_mtime_ns}:{st.st_size}".encode())
+
+    return h.hexdigest()
+
+def build_web_interface(project_dir, web_dir):
+    """Run `npm run build` only when the web sources actually changed
+
+    The Preact/vite build dominates combined-firmware time, so skip it
+    when the source hash matches the one recorded after the last
+    successful build and the build output still exists.
+    """
+    import json
+    cache_path = os.path.join(web_dir, ".build_cache.json")
+    # vite.config.js writes the bundle to data/web
+    output_index = os.path.join(project_dir, "data", "web", "index.html")
+    source_hash = compute_web_source_hash(web_dir)
+
+    if os.path.exists(output_index):
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached.get("hash") == source_hash:
+                debug_log("Web sources unchanged - skipping npm build")
+                return True
+        except (OSError, ValueError):
+            pass
+
+    # Run npm with cwd= rather than os.chdir: the process-wide CWD change
+    # is not safe now that this runs on a worker thread alongside other
+    # post-action work
+    if not os.path.isdir(os.path.join(web_dir, "node_modules")):
+        debug_log("node_modules missing - running npm ci")
+        if run_command(["npm", "ci", "--prefer-offline"], cwd=web_dir) is None:
+            return False
+    if run_command(["npm", "run", "build"], cwd=web_dir) is None:
+        return False
+
+    try:
+        with open(cache_path, "w") as f:
+            json.dump({"hash": source_hash}, f)
+    except OSError as e:
+        debug_log(f"Failed to write web build cache: {e}")
+
+    return True
+
+def write_web_version_file(project_dir):
+    """Regenerate data/web/version.json after the vite build
+
+    vite.config.js builds into data/web with emptyOutDir, which deletes
+    the version.json pre_build.py generated and replaces it with the
+    tracked, stale copy from web/public. The nested `pio run -t buildfs`
+    used to re-run pre_build.py and repair it as a side effect; with
+    mklittlefs invoked directly the repair has to happen here, before
+    the filesystem image is packed, or the web UI's firmware/filesystem
+    sync check reports a mismatch on every release.
+    """
+    version_json_path = os.path.join(project_dir, "data", "web", "version.json")
+    try:
+        with open(version_json_path, "w") as f:
+            f.write(get_web_version_json(log=debug_log))
+        debug_log("Regenerated data/web/version.json after web build")
+        return True
+    except OSError as e:
+        debug_log(f"Failed to regenerate web version file: {e}")
+        return False
+
+def build_littlefs_image(env, project_dir, littlefs_bin):
+    """Build the LittleFS image by invoking mklittlefs directly
+
+    Running `pio run -t buildfs` here bootstraps a whole nested
+    PlatformIO/SCons run just to produce one image. Calling mklittlefs
+    on the data/ directory with the parameters already resolved in the
+    build environment does the same work in a fraction of the time.
+    """
+    data_dir = os.path.join(project_dir, "data")
+    if not os.path.isdir(data_dir):
+        debug_log("ERROR: data directory not found, cannot build filesystem")
+        return False
+
+    mklittlefs = None
+    try:
+        package_dir = env.PioPlatform().get_package_dir("tool-mklittlefs")
+        if package_dir:
+            candidate = os.path.join(package_dir, "mklittlefs")
+            if os.path.exists(candidate) or os.path.exists(candidate + ".exe"):
+                mklittlefs = candidate
+    except Exception as e:
+        debug_log(f"Could not resolve mklittlefs package: {e}")
+
+    if mklittlefs is None:
+        # Fall back to the slow path if the tool package is not available
+        debug_log("mklittlefs not found - falling back to pio buildfs")
+        return run_command(["pio", "run", "-e", env.get("PIOENV"), "-t", "buildfs"]) is not None
+
+    # Filesystem geometry resolved by the platform; defaults match default.csv
+    block_size = str(env.get("FS_BLOCK", 4096))
+    page_size = str(env.get("FS_PAGE", 256))
+    fs_size = env.get("FS_SIZE", 0x160000)
+    if isinstance(fs_size, str):
+        fs_size = int(fs_size, 0)
+
+    result = run_command([
+        mklittlefs,
+        "-c", data_dir,
+        "-b", block_size,
+        "-p", page_size,
+        "-s", str(fs_size),
+        littlefs_bin
+    ])
+    return result is not None
+
+def merge_binaries(env, esptool_args):
+    """Merge the binaries with esptool, in-process when possible
+
+    Importing esptool and calling its main() avoids launching a second
+    Python interpreter (and re-importing esptool) for every merge. The
+    subprocess path is kept as a fallback for setups where the module
+    is not importable.
+    """
+    if esptool is not None:
+        debug_log("Merging binaries with in-process esptool")
+        try:
+            esptool.main(esptool_args)
+            return True
+        except SystemExit as e:
+            if e.code in (0, None):
+                return True
+            debug_log(f"esptool merge failed with exit code {e.code}")
+            return False
+        except Exception as e:
+            debug_log(f"In-process esptool merge failed: {e}")
+            return False
+
+    # Find esptool from PlatformIO packages
+    platformio_packages = env.get("PIOPACKAGES_DIR", "")
+    if platformio_packages:
+        esptool_path = os.path.join(platformio_packages, "tool-esptoolpy", "esptool.py")
+    else:
+        # Fallback to known PlatformIO location
+        home_dir = os.path.expanduser("~")
+        esptool_path = os.path.join(home_dir, ".platformio", "packages", "tool-esptoolpy", "esptool.py")
+
+    # Verify esptool exists
+    if not os.path.exists(esptool_path):
+        # Final fallback to system esptool
+        esptool_path = "esptool.py"
+
+    try:
+        subprocess.run(["python", esptool_path] + esptool_args, check=True, capture_output=True, text=True)
+        return True
+    except subprocess.CalledProcessError as e:
+        debug_log(f"Failed to create combined binary: {e.stderr}")
+        debug_log("Make sure esptool.py is installed: pip install esptool")
+        return False
+    except FileNotFoundError:
+        debug_log("esptool.py not found! Install with: pip install esptool")
+        return False
+
+def locate_bootloader(env, build_dir, build_entries):
+    """Locate the bootloader binary, checking the build dir then the framework SDK"""
+    if "bootloader.bin" in build_entries:
+        return str(build_dir / "bootloader.bin")
+
+    # Try to find bootloader from ESP32 framework
+    framework_dir = env.get("PIOFRAMEWORK_DIR", "")
+    if framework_dir:
+        bootloader_bin = os.path.join(framework_dir, "tools", "sdk", "esp32", "bin", "bootloader_dio_40m.bin")
+        if os.path.exists(bootloader_bin):
+            return bootloader_bin
+
+    debug_log("Warning: Bootloader binary not found, combined firmware may not boot correctly")
+    return None
+
 def create_combined_firmware(source, target, env):
     """Create combined firmware binary after successful build"""
     debug_log("Starting combined firmware creation")
@@ -80,39 +310,37 @@ def create_combined_firmware(source, target, env):
     # Get build environment and paths
     build_env = env.get("PIOENV")
     project_dir = env.get("PROJECT_DIR")
-    build_dir = os.path.join(project_dir, ".pio", "build", build_env)
-    
+    # Resolve the build directory once; the individual files hang off it
+    # with the / operator instead of repeated os.path.join calls
+    build_dir = Path(project_dir, ".pio", "build", build_env)
+
     # Check if required files exist
-    firmware_bin = os.path.join(build_dir, "firmware.bin")
-    littlefs_bin = os.path.join(build_dir, "littlefs.bin")
-    bootloader_bin = os.path.join(build_dir, "bootloader.bin")
-    partitions_bin = os.path.join(build_dir, "partitions.bin")
-    
-    # Find bootloader in ESP32 SDK if not in build dir
-    if not os.path.exists(bootloader_bin):
-        # Try to find bootloader from ESP32 framework
-        framework_dir = env.get("PIOFRAMEWORK_DIR", "")
-        if framework_dir:
-            bootloader_bin = os.path.join(framework_dir, "tools", "sdk", "esp32", "bin", "bootloader_dio_40m.bin")
-        
-        if not os.path.exists(bootloader_bin):
-            debug_log("Warning: Bootloader binary not found, combined firmware may not boot correctly")
-            bootloader_bin = None
-    
+    firmware_bin = str(build_dir / "firmware.bin")
+    littlefs_bin = str(build_dir / "littlefs.bin")
+    partitions_bin = str(build_dir / "partitions.bin")
+
+    # One scandir snapshot answers every artifact probe below with a single
+    # directory read instead of a stat() per os.path.exists call; DirEntry
+    # also carries the stat result we need for mtimes
+    try:
+        build_entries = {e.name: e for e in os.scandir(build_dir)}
+    except OSError:
+        build_entries = {}
+
     # Get build timestamp from version.h
     build_timestamp = get_build_timestamp(project_dir)
-    
+
     # Check if LittleFS needs to be built/rebuilt
     rebuild_fs = False
-    
-    if not os.path.exists(littlefs_bin):
+
+    if "littlefs.bin" not in build_entries:
         debug_log("LittleFS image not found - will build filesystem")
         rebuild_fs = True
     elif build_timestamp is not None:
         # Check if littlefs.bin is older than build timestamp
         from datetime import datetime
-        littlefs_mtime = datetime.fromtimestamp(os.path.getmtime(littlefs_bin))
-        
+        littlefs_mtime = datetime.fromtimestamp(build_entries["littlefs.bin"].stat().st_mtime)
+
         if littlefs_mtime < build_timestamp:
             debug_log(f"LittleFS image is outdated (file: {littlefs_mtime}, build: {build_timestamp})")
             debug_log("Removing old filesystem image and rebuilding...")
@@ -123,108 +351,122 @@ def create_combined_firmware(source, target, env):
     else:
         debug_log("Cannot determine build timestamp - using existing filesystem if available")
     
+    # Fast-fail: when no filesystem rebuild is needed and the existing
+    # combined image is already newer than both inputs, the merge would
+    # only reproduce what is on disk
+    if not rebuild_fs:
+        combined_entry = build_entries.get("firmware_combined.bin")
+        firmware_entry = build_entries.get("firmware.bin")
+        littlefs_entry = build_entries.get("littlefs.bin")
+        if combined_entry is not None and firmware_entry is not None and littlefs_entry is not None:
+            combined_mtime = combined_entry.stat().st_mtime
+            if (combined_mtime >= firmware_entry.stat().st_mtime
+                    and combined_mtime >= littlefs_entry.stat().st_mtime
+                    and os.path.exists(os.path.join(project_dir, "firmware_combined.bin"))):
+                debug_log("Combined firmware is up to date - skipping merge")
+                return
+
     if rebuild_fs:
         debug_log("Building filesystem to match firmware timestamp...")
-        
-        # Build web interface first
+
+        # Build web interface first (no-op when sources are unchanged).
+        # The npm build runs in a worker thread so the bootloader lookup
+        # below overlaps with it instead of waiting for it.
         debug_log("Building Preact web interface...")
         web_dir = os.path.join(project_dir, "web")
+        web_future = None
+        executor = ThreadPoolExecutor(max_workers=1)
         if os.path.exists(web_dir):
-            # Change to web directory and run npm build
-            original_dir = os.getcwd()
-            os.chdir(web_dir)
+            web_future = executor.submit(build_web_interface, project_dir, web_dir)
+        else:
+            debug_log("Warning: web directory not found, skipping npm build")
+
+        bootloader_bin = locate_bootloader(env, build_dir, build_entries)
+
+        if web_future is not None:
             try:
-                npm_build_result = run_command("npm run build")
-                if npm_build_result is None:
-                    debug_log("ERROR: Failed to build web interface!")
-                    debug_log("Cannot create combined firmware without web interface.")
-                    return
-                debug_log("Web interface built successfully")
+                web_ok = web_future.result()
             finally:
-                # Always change back to original directory
-                os.chdir(original_dir)
+                executor.shutdown()
+            if not web_ok:
+                debug_log("ERROR: Failed to build web interface!")
+                debug_log("Cannot create combined firmware without web interface.")
+                return
+            debug_log("Web interface built successfully")
+            # The vite build wiped data/web - restore the generated
+            # version.json before it gets packed into the image
+            if not write_web_version_file(project_dir):
+                debug_log("ERROR: Cannot stamp web version - filesystem would ship stale version.json")
+                return
         else:
-            debug_log("Warning: web directory not found, skipping npm build")
-        
-        # Build filesystem using PlatformIO
-        buildfs_cmd = f"pio run -e {build_env} -t buildfs"
-        result = run_command(buildfs_cmd)
-        
-        if result is None:
+            executor.shutdown()
+
+        # Build filesystem image directly with mklittlefs
+        if not build_littlefs_image(env, project_dir, littlefs_bin):
             debug_log("ERROR: Failed to build filesystem!")
             debug_log("Cannot create combined firmware without filesystem.")
             return
-        
+
         # Verify filesystem was created
         if not os.path.exists(littlefs_bin):
             debug_log("ERROR: Filesystem build completed but littlefs.bin not found!")
             return
-            
+
         debug_log("Filesystem built successfully - proceeding with combined firmware creation.")
-    
-    if not os.path.exists(firmware_bin):
+    else:
+        bootloader_bin = locate_bootloader(env, build_dir, build_entries)
+
+    if "firmware.bin" not in build_entries:
         debug_log("ERROR: Firmware binary not found!")
         return
     
     # Create combined binary using esptool.py
-    combined_bin = os.path.join(build_dir, "firmware_combined.bin")
+    combined_bin = str(build_dir / "firmware_combined.bin")
     
     debug_log(f"Creating combined binary: {combined_bin}")
     
-    # Find esptool from PlatformIO packages
-    platformio_packages = env.get("PIOPACKAGES_DIR", "")
-    if platformio_packages:
-        esptool_path = os.path.join(platformio_packages, "tool-esptoolpy", "esptool.py")
-    else:
-        # Fallback to known PlatformIO location
-        home_dir = os.path.expanduser("~")
-        esptool_path = os.path.join(home_dir, ".platformio", "packages", "tool-esptoolpy", "esptool.py")
-    
-    # Verify esptool exists
-    if not os.path.exists(esptool_path):
-        # Final fallback to system esptool
-        esptool_path = "esptool.py"
-    
-    # Build esptool command for merging binaries  
-    esptool_cmd = ["python", esptool_path, "--chip", "esp32", "merge_bin", "-o", combined_bin]
-    
+    # Build esptool argument list for merging binaries
+    esptool_args = _ESPTOOL_BASE_ARGS + [combined_bin]
+
     # Add bootloader if available
     if bootloader_bin and os.path.exists(bootloader_bin):
-        esptool_cmd.extend(["--flash_mode", "dio", "--flash_freq", "40m", "--flash_size", "4MB"])
-        esptool_cmd.extend(["0x1000", bootloader_bin])
-    
-    # Add partition table if available  
-    if os.path.exists(partitions_bin):
-        esptool_cmd.extend(["0x8000", partitions_bin])
-    
+        esptool_args.extend(["--flash_mode", "dio", "--flash_freq", "40m", "--flash_size", "4MB"])
+        esptool_args.extend(["0x1000", bootloader_bin])
+
+    # Add partition table if available
+    if "partitions.bin" in build_entries:
+        esptool_args.extend(["0x8000", partitions_bin])
+
     # Add main firmware
-    esptool_cmd.extend(["0x10000", firmware_bin])
-    
+    esptool_args.extend(["0x10000", firmware_bin])
+
     # Add filesystem
     # Note: Filesystem address depends on partition scheme, typically 0x290000 for default
-    esptool_cmd.extend(["0x290000", littlefs_bin])
-    
-    # Execute esptool command
+    esptool_args.extend(["0x290000", littlefs_bin])
+
+    if not merge_binaries(env, esptool_args):
+        return
+
+    debug_log("Combined binary created successfully!")
+    debug_log(f"Output: {combined_bin}")
+
+    # Show file size
+    size = os.path.getsize(combined_bin)
+    debug_log(f"Combined binary size: {size:,} bytes ({size/1024/1024:.1f} MB)")
+
+    # Link to project root for easy access; a hardlink avoids re-reading and
+    # re-writing the multi-megabyte image on every build
+    root_combined = os.path.join(project_dir, "firmware_combined.bin")
     try:
-        result = subprocess.run(esptool_cmd, check=True, capture_output=True, text=True)
-        debug_log("Combined binary created successfully!")
-        debug_log(f"Output: {combined_bin}")
-        
-        # Show file size
-        size = os.path.getsize(combined_bin)
-        debug_log(f"Combined binary size: {size:,} bytes ({size/1024/1024:.1f} MB)")
-        
-        # Copy to project root for easy access
-        root_combined = os.path.join(project_dir, "firmware_combined.bin")
+        if os.path.exists(root_combined):
+            os.remove(root_combined)
+        os.link(combined_bin, root_combined)
+        debug_log(f"Combined binary hardlinked to: firmware_combined.bin")
+    except OSError:
+        # Cross-device link or filesystem without hardlink support
         import shutil
         shutil.copy2(combined_bin, root_combined)
         debug_log(f"Combined binary copied to: firmware_combined.bin")
-            
-    except subprocess.CalledProcessError as e:
-        debug_log(f"Failed to create combined binary: {e.stderr}")
-        debug_log("Make sure esptool.py is installed: pip install esptool")
-    except FileNotFoundError:
-        debug_log("esptool.py not found! Install with: pip install esptool")
 
 # Add this as a post-action to run after firmware build
 env.AddPostAction("$BUILD_DIR/firmware.bin", create_combined_firmware)
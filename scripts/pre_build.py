@@ -1,173 +1,50 @@
 Import("env")
 
+import atexit
 import os
-import subprocess
+import sys
 import datetime
 
-# Add debug logging first
+# Add debug logging first. Open the log once at module load - reopening it
+# per message costs an open/write/close syscall triple per line. Line
+# buffering keeps one write per message while still landing each line on
+# disk immediately, so a crashed build leaves a complete log.
+try:
+    _LOG_FH = open("pre_build_debug.log", "a", buffering=1)
+    atexit.register(_LOG_FH.close)
+except OSError:
+    _LOG_FH = None
+
+# Bound once so each log line skips the datetime.datetime.now attribute
+# walk; the f-string format spec goes through datetime.__format__ rather
+# than strftime's locale-aware path
+_NOW = datetime.datetime.now
+
 def debug_log(message):
     """Log debug message to a file for troubleshooting"""
     print(f"PRE-BUILD: {message}")
-    with open("pre_build_debug.log", "a") as f:
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        f.write(f"[{timestamp}] {message}\n")
+    if _LOG_FH is not None:
+        _LOG_FH.write(f"[{_NOW():%Y-%m-%d %H:%M:%S}] {message}\n")
 
-def run_command(command):
-    """Run a shell command and return its output"""
-    debug_log(f"Running command: {command}")
-    try:
-        result = subprocess.run(
-            command, 
-            shell=True, 
-            check=True, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        output = result.stdout.strip()
-        debug_log(f"Command output: {output}")
-        return output
-    except subprocess.CalledProcessError as e:
-        debug_log(f"Command error: {e.stderr}")
-        print(f"Error executing command: {command}")
-        print(f"Error message: {e.stderr}")
-        return "unknown"
-
-def git_is_repo():
-    """Check if current directory is a git repository"""
-    result = run_command("git rev-parse --is-inside-work-tree")
-    is_repo = result == "true"
-    debug_log(f"Is git repo: {is_repo}")
-    return is_repo
-
-def git_get_hash():
-    """Get current git commit hash"""
-    hash_value = run_command("git rev-parse --short HEAD")
-    debug_log(f"Git hash: {hash_value}")
-    return hash_value
-
-def git_get_branch():
-    """Get current branch name"""
-    branch = run_command("git rev-parse --abbrev-ref HEAD")
-    debug_log(f"Git branch: {branch}")
-    return branch
-
-def git_get_tag():
-    """Get latest tag on current commit if any"""
-    tag = run_command("git describe --tags --abbrev=0 2>/dev/null || echo 'no-tag'")
-    debug_log(f"Git tag: {tag}")
-    return tag
-
-def git_get_exact_tag():
-    """Get exact tag on current commit (not just latest)"""
-    tag = run_command("git describe --exact-match --tags HEAD 2>/dev/null || echo ''")
-    debug_log(f"Exact git tag: {tag}")
-    return tag
-
-def git_is_release_tag(tag):
-    """Check if tag is a release version (starts with v followed by number)"""
-    import re
-    is_release = bool(re.match(r'^v\d+', tag))
-    debug_log(f"Is release tag '{tag}': {is_release}")
-    return is_release
+# The version computation (git metadata, source-tree timestamp scan) is
+# shared with the other build scripts and memoized per interpreter in
+# scripts/_version_common.py, so later environment loads reuse it
+sys.path.insert(0, os.path.join(env.get("PROJECT_DIR", os.getcwd()), "scripts"))
+from _version_common import get_version_data, get_web_version_json
 
 debug_log("Pre-build script started")
 debug_log(f"Working directory: {os.getcwd()}")
 
-def get_most_recent_source_timestamp():
-    """Find the most recently modified source file and use its timestamp"""
-    import glob
-    import os
-    
-    # Define source file patterns to check
-    # Exclude generated files (version.h, version.json) and build artifacts
-    source_patterns = [
-        "src/**/*.cpp",
-        "src/**/*.c", 
-        "src/**/*.h",
-        "include/*.h",
-        "web/src/**/*.jsx",
-        "web/src/**/*.js",
-        "web/src/**/*.css",
-        "web/public/**/*.*",
-        "platformio.ini",
-        "package.json"
-    ]
-    
-    # Files to explicitly exclude
-    exclude_files = {
-        "include/version.h",
-        "data/web/version.json",
-        "web/public/version.json"
-    }
-    
-    most_recent_time = 0
-    most_recent_file = None
-    
-    for pattern in source_patterns:
-        for filepath in glob.glob(pattern, recursive=True):
-            # Normalize path for comparison
-            filepath = filepath.replace("\\", "/")
-            
-            # Skip excluded files
-            if filepath in exclude_files:
-                continue
-                
-            # Skip directories
-            if os.path.isdir(filepath):
-                continue
-                
-            try:
-                mtime = os.path.getmtime(filepath)
-                if mtime > most_recent_time:
-                    most_recent_time = mtime
-                    most_recent_file = filepath
-            except OSError:
-                # File might have been deleted or is inaccessible
-                continue
-    
-    if most_recent_file:
-        # Convert timestamp to datetime
-        dt = datetime.datetime.fromtimestamp(most_recent_time)
-        timestamp_str = dt.strftime("%Y-%m-%d %H:%M:%S")
-        debug_log(f"Most recent source file: {most_recent_file}")
-        debug_log(f"Source file timestamp: {timestamp_str}")
-        return timestamp_str
-    else:
-        # Fallback to current time if no source files found
-        timestamp_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        debug_log(f"No source files found, using current time: {timestamp_str}")
-        return timestamp_str
-
-# Get timestamp based on most recent source file
-timestamp = get_most_recent_source_timestamp()
-debug_log(f"Using timestamp: {timestamp}")
-
-# Default version information if not in a git repo
-version_info = f"Build: {timestamp}"
-exact_tag = ""  # Initialize for non-git scenarios
-git_hash = "unknown"
-git_branch = "unknown"
-
-# Check if we're in a git repository
-if git_is_repo():
-    git_hash = git_get_hash()
-    git_branch = git_get_branch()
-    git_tag = git_get_tag()
-    exact_tag = git_get_exact_tag()
-    
-    # If we're on a release tag, use simplified version string
-    if exact_tag and git_is_release_tag(exact_tag):
-        version_info = f"{exact_tag} - Build: {timestamp}"
-    else:
-        # For development builds, include full git information
-        version_info = f"Git: {git_branch}@{git_hash} ({git_tag}) - Build: {timestamp}"
-
-debug_log(f"Generated version: {version_info}")
+version_data = get_version_data(log=debug_log)
+timestamp = version_data["timestamp"]
+version_info = version_data["version_info"]
+git_hash = version_data["git_hash"]
+git_branch = version_data["git_branch"]
+exact_tag = version_data["exact_tag"]
 
 # Create header file with release version if applicable
 release_define = ""
-if exact_tag and git_is_release_tag(exact_tag):
+if version_data["is_release"]:
     release_define = f'#define RELEASE_VERSION "{exact_tag}"\n'
 
 header_content = f'''#ifndef VERSION_H
@@ -177,13 +54,82 @@ header_content = f'''#ifndef VERSION_H
 {release_define}#endif
 '''
 
-# Always create version.h with the consistent timestamp
-try:
-    with open("include/version.h", "w") as f:
-        f.write(header_content)
-    debug_log("Created/updated version.h header file")
-except Exception as e:
-    debug_log(f"Failed to create version.h: {e}")
+# Sentinel recording the inputs of the last generated version files; when
+# neither the source timestamp nor the git state moved, the generation and
+# comparison work below is skipped entirely (the GIT_VERSION define is
+# still appended from the same computed version_info)
+version_stamp_path = os.path.join(".pio", "build", "version.stamp")
+version_stamp = {
+    "timestamp": timestamp,
+    "git_hash": git_hash,
+    "exact_tag": exact_tag,
+    "version_info": version_info
+}
+
+def version_stamp_matches():
+    """Check whether the version inputs are unchanged since the last run"""
+    import json
+    try:
+        with open(version_stamp_path) as f:
+            return json.load(f) == version_stamp
+    except (OSError, ValueError):
+        return False
+
+def write_version_stamp():
+    """Record the version inputs used for the generated files"""
+    import json
+    try:
+        os.makedirs(os.path.dirname(version_stamp_path), exist_ok=True)
+        with open(version_stamp_path, "w") as f:
+            json.dump(version_stamp, f)
+    except OSError as e:
+        debug_log(f"Failed to write version stamp: {e}")
+
+# Serialized data/web/version.json content for this build; shared with
+# create_combined_firmware.py, which regenerates the file after the vite
+# build wipes data/web
+web_version_content = get_web_version_json(log=debug_log)
+
+def web_version_file_current():
+    """Check that data/web/version.json holds this build's content
+
+    The web build can wipe or replace the file after we wrote it, so the
+    stamp alone cannot vouch for it - verify the actual bytes.
+    """
+    if not os.path.exists("data"):
+        # Nothing to generate, so nothing can be stale
+        return True
+    try:
+        with open(os.path.join("data", "web", "version.json")) as f:
+            return f.read() == web_version_content
+    except OSError:
+        return False
+
+skip_version_files = (version_stamp_matches()
+                      and os.path.exists("include/version.h")
+                      and web_version_file_current())
+if skip_version_files:
+    debug_log("Version inputs unchanged - skipping version file generation")
+
+# Only rewrite version.h when its content actually changed - touching its
+# mtime needlessly forces a recompile of every source file that includes it
+if not skip_version_files:
+    existing_header = None
+    try:
+        with open("include/version.h") as f:
+            existing_header = f.read()
+    except OSError:
+        pass
+
+    if existing_header == header_content:
+        debug_log("version.h unchanged, skipping write")
+    else:
+        try:
+            with open("include/version.h", "w") as f:
+                f.write(header_content)
+            debug_log("Created/updated version.h header file")
+        except Exception as e:
+            debug_log(f"Failed to create version.h: {e}")
 
 # Add build flag to PlatformIO environment
 try:
@@ -210,26 +156,30 @@ def create_web_version_file():
         debug_log("Created data/web directory")
     
     version_json_path = os.path.join(data_web_dir, "version.json")
-    
-    # Use the EXACT SAME timestamp as version.h
-    version_json_content = {
-        "filesystem_version": version_info,
-        "build_time": timestamp,  # Same timestamp as version.h
-        "description": "ESP32 ET112 Proxy Web Interface",
-        "git_hash": git_hash,
-        "git_branch": git_branch
-    }
-    
+
+    # Content comes from the shared serializer so this file matches the
+    # one create_combined_firmware.py regenerates after the web build
     try:
-        import json
+        # Same treatment as version.h: leave the file alone when nothing
+        # changed so its mtime doesn't mark the filesystem image stale
+        try:
+            with open(version_json_path) as f:
+                if f.read() == web_version_content:
+                    debug_log("version.json unchanged, skipping write")
+                    return
+        except OSError:
+            pass
+
         with open(version_json_path, "w") as f:
-            json.dump(version_json_content, f, indent=2)
+            f.write(web_version_content)
         debug_log(f"Created web version file: {version_json_path}")
         debug_log(f"Web version: {version_info}")
     except Exception as e:
         debug_log(f"Failed to create web version file: {e}")
 
-# Create web version file
-create_web_version_file()
+# Create web version file and record the inputs used
+if not skip_version_files:
+    create_web_version_file()
+    write_version_stamp()
 
 debug_log("Pre-build script completed successfully")
\ No newline at end of file
@@ -1,6 +1,8 @@
 #!/bin/env python3
-import socket
+import asyncio
+import struct
 import sys
+from functools import lru_cache
 from pymodbus.constants import Endian
 from pymodbus.payload import BinaryPayloadDecoder
 from pymodbus.client.sync import ModbusTcpClient
@@ -21,68 +23,101 @@ TCP_PORT = int(sys.argv[2])  # Get port from command line argument and convert t
 #TCP_IP = '192.168.28.42'
 #TCP_PORT = 8899  # Replace with your port number
 
-BUFFER_SIZE = 1024  # Adjust based on your expected message sizes
+BUFFER_SIZE = 65536  # Per-recv chunk; large enough to drain the socket buffer in one syscall
 
-def crc16(data):
-    crc = 0xFFFF
-    for pos in data:
-        crc ^= pos
+# Structs compiled once at import - struct.unpack_from with a format string
+# re-parses the format on every call, a pre-built Struct skips that
+_U16_BE = struct.Struct(">H")
+_U16_LE = struct.Struct("<H")
+_REQUEST_BODY = struct.Struct(">HH")
+
+@lru_cache(maxsize=None)
+def _registers_struct(count):
+    """Big-endian Struct for a run of count registers, built once per count"""
+    return struct.Struct(">" + "H" * count)
+
+def _build_crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte
         for _ in range(8):
             if (crc & 1) != 0:
                 crc >>= 1
                 crc ^= 0xA001
             else:
                 crc >>= 1
+        table.append(crc)
+    return table
+
+# Precomputed at import so crc16 does one table lookup per byte instead of
+# eight bit-test iterations
+CRC16_TABLE = _build_crc16_table()
+
+def crc16(data):
+    crc = 0xFFFF
+    for pos in data:
+        crc = (crc >> 8) ^ CRC16_TABLE[(crc ^ pos) & 0xFF]
     return crc
 
 def split_frames(data):
+    """Split data into complete frames, returning (frames, consumed)
+
+    consumed is the index of the first byte not fully parsed; the caller
+    keeps the tail so a frame straddling two reads is completed by the
+    next one instead of being discarded.
+    """
     frames = []
+    # A memoryview makes the frame slices below zero-copy
+    mv = memoryview(data)
+    length = len(mv)
     i = 0
-    while i < len(data):
+    while i < length:
         # Minimum length for a Modbus RTU frame is 4 bytes (excluding CRC)
-        if i + 4 > len(data):
+        if i + 4 > length:
             break  # Not enough data for a valid frame
 
-        slave_id, function_code = data[i], data[i+1]
+        function_code = mv[i+1]
         if function_code == 0x03:  # Function code for reading registers
-            if i + 5 <= len(data) and (data[i+2] << 8) + data[i+3] <= 0x007D:  # Max 125 registers can be requested
+            if i + 5 <= length and _U16_BE.unpack_from(mv, i+2)[0] <= 0x007D:  # Max 125 registers can be requested
                 # Assuming it's a request frame (fixed length of 8 bytes)
                 frame_len = 8
-            elif i + 2 < len(data):
+            elif i + 2 < length:
                 # Assuming it's a response frame (variable length)
-                byte_count = data[i+2]
+                byte_count = mv[i+2]
                 frame_len = 3 + byte_count + 2  # Slave ID + Function Code + Byte Count + Data + CRC
             else:
                 break  # Not enough data for a valid frame
 
-            if i + frame_len <= len(data):
-                frames.append(data[i:i+frame_len])
+            if i + frame_len <= length:
+                frames.append(mv[i:i+frame_len])
                 i += frame_len
             else:
                 break  # Not enough data for the complete frame
         else:
             i += 1  # Move to the next byte if function code doesn't match
 
-    return frames
+    return frames, i
 
 def decode_frames(frames):
-    for frame in frames:
-        decode_message(frame)
+    # Batch the output: one stdout write per frame batch instead of a
+    # locked, flushing print per frame
+    lines = [decode_message(frame) for frame in frames]
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")
+
 def decode_message(message):
     if len(message) < 5:  # Minimum length check
-        print("Incomplete or corrupt message received")
-        return
+        return "Incomplete or corrupt message received"
 
-    # Extract the CRC from the message
-    received_crc = message[-2] + (message[-1] << 8)
+    # Extract the CRC from the message (little-endian on the wire)
+    received_crc, = _U16_LE.unpack_from(message, len(message) - 2)
 
     # Calculate the CRC of the message (excluding the received CRC part)
     calculated_crc = crc16(message[:-2])
 
     # Compare the received CRC with the calculated CRC
     if received_crc != calculated_crc:
-        print("CRC check failed")
-        return
+        return "CRC check failed"
 
     slave_id, function_code = message[0], message[1]
 
@@ -90,33 +125,58 @@ def decode_message(message):
     if function_code == 0x03:
         # Distinguish between request and response frames
         if len(message) == 8:  # Likely a request frame
-            start_address = (message[2] << 8) + message[3]
-            num_registers = (message[4] << 8) + message[5]
-            print(f"Request Frame - Slave ID: {slave_id}, Function Code: {function_code}, Start Address: {start_address}, Number of Registers: {num_registers}")
+            start_address, num_registers = _REQUEST_BODY.unpack_from(message, 2)
+            return f"Request Frame - Slave ID: {slave_id}, Function Code: {function_code}, Start Address: {start_address}, Number of Registers: {num_registers}"
         else:  # Likely a response frame
             byte_count = message[2]
-            register_data = message[3:3+byte_count]
-            registers = [((register_data[i] << 8) + register_data[i+1]) for i in range(0, len(register_data), 2)]
-            print(f"Response Frame - Slave ID: {slave_id}, Function Code: {function_code}, Byte Count: {byte_count}, Register Values: {registers}")
+            # One C-level bulk decode with a Struct cached per register
+            # count; the ET112 polling loop reuses a handful of counts, so
+            # after the first frame of each shape this is a dict hit
+            registers = list(_registers_struct(byte_count // 2).unpack_from(message, 3))
+            return f"Response Frame - Slave ID: {slave_id}, Function Code: {function_code}, Byte Count: {byte_count}, Register Values: {registers}"
     else:
-        print(f"Unsupported Function Code: {function_code}")
-
-def main():
-    # TCP connection setup
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.connect((TCP_IP, TCP_PORT))
-
+        return f"Unsupported Function Code: {function_code}"
+
+async def read_stream(reader, queue):
+    """Producer: drain the socket and queue complete frames for decoding
+
+    The persistent reassembly buffer works as before: any partial frame
+    left by split_frames stays in buf and is completed by the next read.
+    """
+    buf = bytearray()
+    while True:
+        data = await reader.read(BUFFER_SIZE)
+        if not data:
+            break
+        buf += data
+        frames, consumed = split_frames(buf)
+        if frames:
+            # Materialize the frame views before the buffer is trimmed;
+            # the consumer decodes them while we wait on the next read
+            await queue.put([bytes(frame) for frame in frames])
+            del frames
+        if consumed:
+            del buf[:consumed]
+    await queue.put(None)  # EOF sentinel
+
+async def decode_stream(queue):
+    """Consumer: decode queued frame batches while the producer reads"""
+    while True:
+        frames = await queue.get()
+        if frames is None:
+            break
+        decode_frames(frames)
+
+async def main():
+    # TCP connection setup; the producer/consumer split lets the CPU-side
+    # frame decode overlap with waiting on socket I/O
+    reader, writer = await asyncio.open_connection(TCP_IP, TCP_PORT)
+    queue = asyncio.Queue()
     try:
-        while True:
-            data = sock.recv(BUFFER_SIZE)
-            if data:
-                #print("Raw data received:", data.hex())
-                frames = split_frames(data)
-                decode_frames(frames)
-            else:
-                break
+        await asyncio.gather(read_stream(reader, queue), decode_stream(queue))
     finally:
-        sock.close()
+        writer.close()
+        await writer.wait_closed()
 
 if __name__ == '__main__':
-    main()
+    asyncio.run(main())